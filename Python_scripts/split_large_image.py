@@ -0,0 +1,517 @@
+"""
+Split Large Image
+=================
+
+Batch replacement for the interactive SplitLargeImage.ijm macro. Crops
+whole-plate scans into standardized RRQuant images
+(sample--stain--rep_N--img.tif) from a crop manifest (CSV/JSON), or from
+seedling regions auto-detected on a low-resolution overview of the plate.
+
+Only the TIFF strips/tiles overlapping the crops are read and decoded, in a
+single pass over each plate (uncompressed images are memory-mapped, so only
+the needed rows are read), and several plates are processed in parallel.
+A compressed image stored as a single strip has to be decoded whole.
+
+Manifest columns (CSV header or JSON object keys):
+    sample, stain, rep, x, y, width, height [, plate]
+Rows with an empty/missing "plate" apply to every plate given.
+
+Dependencies:
+    numpy, scipy, tifffile, tkinter
+"""
+
+import os
+import re
+import csv
+import sys
+import json
+import argparse
+import tkinter as tk
+from tkinter import filedialog
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+import tifffile
+from scipy import ndimage
+
+# --- Naming (same rules as SplitLargeImage.ijm) ---
+IMG_SUFFIX = "--img.tif"
+STAIN_CHOICES = ("Stained", "NonStained")
+DEFAULT_STAIN = "NonStained"
+SAMPLE_PATTERN = re.compile(r"^[A-Za-z0-9_.+-]+$")
+
+# --- Auto-detection Defaults ---
+OVERVIEW_MAX_PIXELS = 4_000_000  # Overview is decimated below ~2000x2000
+DETECT_MERGE_GAP = 200  # (pixels, full resolution) Seedlings closer than this are grouped
+DETECT_MIN_AREA = 50_000  # (pixels, full resolution) Smaller regions are ignored
+DETECT_PADDING = 50  # (pixels, full resolution) Margin added around each region
+
+# TIFF planar configuration for interleaved samples (e.g. RGB)
+PLANAR_CONTIG = 1
+PHOTOMETRIC = tifffile.PHOTOMETRIC
+COMPRESSION = tifffile.COMPRESSION
+
+Crop = Dict[str, Any]
+
+
+def crop_filename(crop: Crop) -> str:
+    """Returns the standardized RRQuant image name for a crop."""
+    return f"{crop['sample']}--{crop['stain']}--rep_{crop['rep']}{IMG_SUFFIX}"
+
+
+def _sample_from_plate(plate_name: str) -> str:
+    """Sample name for auto-detected regions (plate name, invalid characters and '--' as '_')."""
+    sample = re.sub(r"[^A-Za-z0-9_.+-]", "_", os.path.splitext(plate_name)[0])
+    return re.sub(r"-{2,}", "_", sample)
+
+
+def _validate_crop(crop: Crop, source: str) -> Crop:
+    """Checks names and rectangle of a manifest entry, returns a normalized copy."""
+    try:
+        sample = str(crop["sample"]).strip()
+        stain = str(crop.get("stain") or DEFAULT_STAIN).strip()
+        rep = int(crop["rep"])
+        x, y = int(crop["x"]), int(crop["y"])
+        width, height = int(crop["width"]), int(crop["height"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{source}: missing or invalid field ({e})")
+
+    if not SAMPLE_PATTERN.match(sample) or "--" in sample:
+        raise ValueError(f"{source}: invalid sample name '{sample}' "
+                         "(no spaces, special characters or '--')")
+    if stain not in STAIN_CHOICES:
+        raise ValueError(f"{source}: stain must be one of {STAIN_CHOICES}, got '{stain}'")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"{source}: crop width and height must be positive")
+
+    return {
+        "plate": str(crop.get("plate") or "").strip(),
+        "sample": sample, "stain": stain, "rep": rep,
+        "x": x, "y": y, "width": width, "height": height,
+    }
+
+
+def load_manifest(manifest_path: str) -> List[Crop]:
+    """Reads a CSV or JSON crop manifest."""
+    if manifest_path.lower().endswith(".json"):
+        with open(manifest_path, encoding="utf-8-sig") as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            # {"plate.tif": [crop, ...], ...}
+            entries = [dict(c, plate=plate) for plate, crops in entries.items() for c in crops]
+    else:
+        # utf-8-sig: manifests saved from Excel start with a byte order mark
+        with open(manifest_path, newline="", encoding="utf-8-sig") as f:
+            entries = list(csv.DictReader(f))
+
+    crops = [_validate_crop(c, f"{os.path.basename(manifest_path)} entry {i + 1}")
+             for i, c in enumerate(entries)]
+    if not crops:
+        raise ValueError(f"No crops defined in {manifest_path}")
+    return crops
+
+
+def write_manifest(manifest_path: str, crops: List[Crop]) -> None:
+    """Writes crops to a CSV manifest (editable and re-usable with --manifest)."""
+    fields = ["plate", "sample", "stain", "rep", "x", "y", "width", "height"]
+    with open(manifest_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for crop in crops:
+            writer.writerow({k: crop[k] for k in fields})
+
+
+def crops_for_plate(plate_path: str, crops: List[Crop]) -> List[Crop]:
+    """Selects the manifest crops matching a plate (by file name or stem)."""
+    name = os.path.basename(plate_path)
+    stem = os.path.splitext(name)[0]
+    return [c for c in crops if c["plate"] in ("", name, stem)]
+
+
+# --- TIFF Segment Reading ---
+
+def _sample_shape(page: tifffile.TiffPage) -> Tuple[int, ...]:
+    """Trailing (samples,) dimension of the image, empty for grayscale."""
+    return (page.samplesperpixel,) if page.samplesperpixel > 1 else ()
+
+
+def _memmap(tif: tifffile.TiffFile, page: tifffile.TiffPage) -> Optional[np.ndarray]:
+    """
+    Memory-maps uncompressed, contiguous image data (e.g. TIFF saved by ImageJ,
+    usually a single strip) as (rows, columns[, samples]), so that slicing only
+    reads the needed rows from disk. Returns None for other files.
+    """
+    if not page.is_memmappable:
+        return None
+    image = tifffile.memmap(tif.filehandle.path, page=page.index, mode="r")
+    if page.planarconfig != PLANAR_CONTIG and page.samplesperpixel > 1:
+        image = np.moveaxis(image, 0, -1)
+    return image
+
+
+def _iter_segments(tif: tifffile.TiffFile, page: tifffile.TiffPage,
+                   boxes: List[Tuple[int, int, int, int]]):
+    """
+    Decodes, in file order, every strip/tile of `page` overlapping at least one
+    of the (top, left, bottom, right) boxes (in each sample plane for
+    planar-separate images).
+    Yields (plane, top, left, segment) with segment of shape (rows, columns, samples);
+    plane is the index of the first sample in the segment.
+    """
+    if page.is_tiled:
+        seg_h, seg_w = page.tilelength, page.tilewidth
+    else:
+        seg_h, seg_w = min(page.rowsperstrip or page.imagelength, page.imagelength), page.imagewidth
+    n_across = -(-page.imagewidth // seg_w)
+    n_planes = page.samplesperpixel if page.planarconfig != PLANAR_CONTIG else 1
+    per_plane = len(page.dataoffsets) // n_planes
+
+    needed = set()
+    for top, left, bottom, right in boxes:
+        for row in range(top // seg_h, (bottom - 1) // seg_h + 1):
+            for col in range(left // seg_w, (right - 1) // seg_w + 1):
+                needed.update(plane * per_plane + row * n_across + col
+                              for plane in range(n_planes))
+    indices = sorted(needed)
+
+    offsets = [page.dataoffsets[i] for i in indices]
+    bytecounts = [page.databytecounts[i] for i in indices]
+    for data, index in tif.filehandle.read_segments(offsets, bytecounts, indices=indices):
+        segment, (plane, _, y0, x0, _), _ = page.decode(data, index, jpegtables=page.jpegtables)
+        if segment is None:
+            # Empty segment: tifffile leaves missing data as zeros
+            continue
+        yield plane, y0, x0, segment.reshape(segment.shape[-3:])
+
+
+def _overview(tif: tifffile.TiffFile, page: tifffile.TiffPage) -> Tuple[np.ndarray, int]:
+    """
+    Returns a low-resolution overview of the plate and its decimation factor.
+    Uses the smallest pyramid level if the file has one, otherwise decimates the
+    full-resolution image strip by strip (or through a memory map), never holding
+    it in memory. A compressed single-strip image is decoded whole, as its only
+    strip is the whole image.
+    """
+    height, width = page.imagelength, page.imagewidth
+    levels = tif.series[0].levels
+    if len(levels) > 1:
+        level = levels[-1].asarray()
+        return level, max(1, round(height / level.shape[0]))
+
+    factor = max(1, int(np.ceil(np.sqrt(height * width / OVERVIEW_MAX_PIXELS))))
+    image = _memmap(tif, page)
+    if image is not None:
+        return np.array(image[::factor, ::factor]), factor
+
+    shape = (-(-height // factor), -(-width // factor), page.samplesperpixel)
+    overview = np.zeros(shape, dtype=page.dtype)
+    for plane, y0, x0, segment in _iter_segments(tif, page, [(0, 0, height, width)]):
+        segment = segment[:height - y0, :width - x0]
+        sub = segment[(-y0) % factor::factor, (-x0) % factor::factor]
+        oy, ox = -(-y0 // factor), -(-x0 // factor)
+        overview[oy:oy + sub.shape[0], ox:ox + sub.shape[1], plane:plane + sub.shape[2]] = sub
+    return overview.reshape(shape[:2] + _sample_shape(page)), factor
+
+
+def detect_regions(tif: tifffile.TiffFile, page: tifffile.TiffPage, plate_name: str,
+                   stain: str, merge_gap: int, min_area: int, padding: int) -> List[Crop]:
+    """
+    Finds groups of seedlings on a low-resolution overview of the plate.
+    Foreground is the RR intensity used by RRQuant.ijm (Saturation + inverted
+    Brightness), thresholded with Otsu's method.
+    """
+    overview, factor = _overview(tif, page)
+    rgb = overview[..., :3].astype(np.float32) if overview.ndim == 3 else \
+        np.repeat(overview[..., None].astype(np.float32), 3, axis=2)
+    if overview.dtype != np.uint8:
+        rgb *= 255.0 / max(float(rgb.max()), 1.0)
+
+    brightness = rgb.max(axis=2)
+    saturation = np.where(brightness > 0,
+                          255.0 * (brightness - rgb.min(axis=2)) / np.maximum(brightness, 1.0), 0.0)
+    intensity = saturation + (255.0 - brightness)
+    threshold = _otsu_threshold(intensity)
+    if threshold is None:
+        print(f"  -> {plate_name}: uniform image (blank or over-exposed plate?), no regions detected")
+        return []
+    foreground = intensity > threshold
+
+    # Each closing iteration bridges gaps of 2 overview pixels. Padding keeps the
+    # erosion from eating into regions touching the plate edge.
+    iterations = max(1, merge_gap // (2 * factor))
+    foreground = ndimage.binary_closing(np.pad(foreground, iterations), structure=np.ones((3, 3)),
+                                        iterations=iterations)[iterations:-iterations, iterations:-iterations]
+    labels, _ = ndimage.label(foreground)
+
+    sample = _sample_from_plate(plate_name)
+    crops = []
+    for slc in ndimage.find_objects(labels):
+        top, bottom = slc[0].start * factor, slc[0].stop * factor
+        left, right = slc[1].start * factor, slc[1].stop * factor
+        if (bottom - top) * (right - left) < min_area:
+            continue
+        top, left = max(0, top - padding), max(0, left - padding)
+        bottom = min(page.imagelength, bottom + padding)
+        right = min(page.imagewidth, right + padding)
+        crops.append(_validate_crop({
+            "plate": plate_name, "sample": sample, "stain": stain, "rep": len(crops) + 1,
+            "x": left, "y": top, "width": right - left, "height": bottom - top,
+        }, f"{plate_name} region {len(crops) + 1}"))
+    return crops
+
+
+def _otsu_threshold(values: np.ndarray, bins: int = 256) -> Optional[float]:
+    """Otsu's threshold of an array, None if the array is uniform."""
+    if values.min() == values.max():
+        return None
+    hist, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    cum_mean = np.cumsum(hist * centers)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_bg = cum_mean / weight_bg
+        mean_fg = (cum_mean[-1] - cum_mean) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    if np.all(np.isnan(variance)):
+        return None
+    return float(centers[np.nanargmax(variance)])
+
+
+# --- Plate Processing ---
+
+def _photometric_kwargs(page: tifffile.TiffPage) -> Dict[str, Any]:
+    """
+    Photometric interpretation of the decoded (and saved uncompressed) pixels,
+    which is not always the one of the source plate.
+    """
+    photometric = page.photometric
+    if photometric in (PHOTOMETRIC.MINISBLACK, PHOTOMETRIC.MINISWHITE, PHOTOMETRIC.RGB):
+        return {"photometric": photometric}
+    if photometric == PHOTOMETRIC.YCBCR:
+        # JPEG is decoded to RGB; other YCbCr data is decoded as is, without subsampling
+        if page.compression in (COMPRESSION.JPEG, COMPRESSION.OJPEG):
+            return {"photometric": PHOTOMETRIC.RGB}
+        return {"photometric": photometric, "subsampling": (1, 1)}
+    if photometric == PHOTOMETRIC.PALETTE:
+        return {"photometric": photometric, "colormap": page.colormap}
+    raise ValueError(f"Unsupported photometric interpretation: {photometric.name}")
+
+
+def _write_kwargs(tif: tifffile.TiffFile, page: tifffile.TiffPage) -> Dict[str, Any]:
+    """Keeps photometric interpretation and pixel size of the source plate."""
+    kwargs = _photometric_kwargs(page)
+    tags = page.tags
+    if "XResolution" in tags and "YResolution" in tags:
+        kwargs["resolution"] = (tags["XResolution"].value, tags["YResolution"].value)
+        if tif.is_imagej and (tif.imagej_metadata or {}).get("unit"):
+            kwargs["imagej"] = True
+            kwargs["metadata"] = {"unit": tif.imagej_metadata["unit"]}
+        elif "ResolutionUnit" in tags:
+            kwargs["resolutionunit"] = tags["ResolutionUnit"].value
+    return kwargs
+
+
+def split_plate(plate_path: str, output_dir: str, crops: Optional[List[Crop]],
+                detect: Optional[Dict[str, Any]] = None) -> List[str]:
+    """
+    Crops one plate scan and saves each crop in `output_dir`.
+    If `crops` is None, regions are auto-detected with the `detect` settings and
+    also written to <plate>--regions.csv for renaming/re-use as a manifest.
+    Returns the list of saved files.
+    """
+    plate_name = os.path.basename(plate_path)
+    with tifffile.TiffFile(plate_path) as tif:
+        page = tif.pages.first
+        height, width = page.imagelength, page.imagewidth
+        kwargs = _write_kwargs(tif, page)
+
+        if crops is None:
+            crops = detect_regions(tif, page, plate_name, **detect)
+            regions_csv = os.path.join(output_dir, os.path.splitext(plate_name)[0] + "--regions.csv")
+            write_manifest(regions_csv, crops)
+            print(f"  -> {plate_name}: {len(crops)} regions detected ({os.path.basename(regions_csv)})")
+
+        # Clip rectangles to the image, as ImageJ does with out-of-bounds selections
+        boxes = []
+        for crop in crops:
+            top, left = max(0, crop["y"]), max(0, crop["x"])
+            bottom = min(height, crop["y"] + crop["height"])
+            right = min(width, crop["x"] + crop["width"])
+            if bottom <= top or right <= left:
+                raise ValueError(f"Crop {crop_filename(crop)} is outside of {plate_name} "
+                                 f"({width}x{height})")
+            boxes.append((top, left, bottom, right))
+
+        image = _memmap(tif, page)
+        if image is not None:
+            outputs = [np.array(image[t:b, l:r]) for t, l, b, r in boxes]
+        else:
+            outputs = [np.zeros((b - t, r - l, page.samplesperpixel), dtype=page.dtype)
+                       for t, l, b, r in boxes]
+
+            # Single pass over the needed strips/tiles, each pasted in every crop it overlaps
+            for plane, y0, x0, segment in _iter_segments(tif, page, boxes):
+                seg_bottom, seg_right = y0 + segment.shape[0], x0 + segment.shape[1]
+                samples = slice(plane, plane + segment.shape[2])
+                for (top, left, bottom, right), out in zip(boxes, outputs):
+                    t, b = max(top, y0), min(bottom, seg_bottom)
+                    l, r = max(left, x0), min(right, seg_right)
+                    if b <= t or r <= l:
+                        continue
+                    out[t - top:b - top, l - left:r - left, samples] = segment[
+                        t - y0:b - y0, l - x0:r - x0]
+            outputs = [out.reshape(out.shape[:2] + _sample_shape(page)) for out in outputs]
+        del image
+
+    saved = []
+    for crop, out in zip(crops, outputs):
+        dest_path = os.path.join(output_dir, crop_filename(crop))
+        tifffile.imwrite(dest_path, out, **kwargs)
+        saved.append(dest_path)
+    return saved
+
+
+def _split_plate_task(args: Tuple) -> Tuple[str, List[str], Optional[str]]:
+    """Worker wrapper: reports errors instead of raising across processes."""
+    plate_path = args[0]
+    try:
+        return plate_path, split_plate(*args), None
+    except Exception as e:
+        return plate_path, [], str(e)
+
+
+def split_plates(plate_paths: List[str], output_dir: str, crops: Optional[List[Crop]],
+                 detect: Optional[Dict[str, Any]] = None, workers: Optional[int] = None) -> None:
+    """Crops several plates, in parallel across plates."""
+    tasks = []
+    for plate_path in plate_paths:
+        plate_crops = None if crops is None else crops_for_plate(plate_path, crops)
+        if plate_crops is not None and not plate_crops:
+            print(f"No crops defined for {os.path.basename(plate_path)}, skipping.")
+            continue
+        tasks.append((plate_path, output_dir, plate_crops, detect))
+
+    # Guard against two crops overwriting the same output file. Auto-detected
+    # crops are named after the plate, so plates must give distinct sample names.
+    if crops is not None:
+        names = [crop_filename(c) for t in tasks for c in t[2]]
+    else:
+        names = [crop_filename({"sample": _sample_from_plate(os.path.basename(t[0])),
+                                "stain": detect["stain"], "rep": 1}) for t in tasks]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Several crops would be saved as: {', '.join(duplicates)}")
+
+    workers = min(workers or os.cpu_count() or 1, max(1, len(tasks)))
+    if workers == 1:
+        _report(map(_split_plate_task, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            _report(executor.map(_split_plate_task, tasks))
+
+
+def _report(results) -> None:
+    """Prints the files saved (or the error) for each plate as they complete."""
+    for plate_path, saved, error in results:
+        if error:
+            print(f"Failed to process {plate_path}: {error}")
+            continue
+        print(f"{os.path.basename(plate_path)}: {len(saved)} images saved")
+        for path in saved:
+            print(f"  <= {os.path.basename(path)}")
+
+
+def _plate_files(inputs: List[str]) -> List[str]:
+    """Expands directories into the TIFF files they contain."""
+    plates = []
+    for path in inputs:
+        if os.path.isdir(path):
+            plates += sorted(f for f in glob(os.path.join(path, "*"))
+                             if f.lower().endswith((".tif", ".tiff")) and not f.endswith(IMG_SUFFIX))
+        else:
+            plates.append(path)
+    return plates
+
+
+def get_args_or_dialog() -> Optional[argparse.Namespace]:
+    """
+    Parses CLI arguments. If missing, launches Tkinter dialogs to ask the user.
+    """
+    parser = argparse.ArgumentParser(
+        description="Crop large plate scans into RRQuant images (sample--stain--rep_N--img.tif)."
+    )
+    parser.add_argument("plates", nargs="*", help="Plate scans (TIFF) or directories containing them.")
+    parser.add_argument("--output", help="Directory to save the cropped images.")
+    parser.add_argument("--manifest", help="Crop manifest (.csv or .json).")
+    parser.add_argument("--detect", action="store_true",
+                        help="Auto-detect seedling regions instead of using a manifest.")
+    parser.add_argument("--stain", choices=STAIN_CHOICES, default=DEFAULT_STAIN,
+                        help="Stain used to name auto-detected regions.")
+    parser.add_argument("--merge-gap", type=int, default=DETECT_MERGE_GAP,
+                        help="Auto-detection: seedlings closer than this (pixels) are grouped.")
+    parser.add_argument("--min-area", type=int, default=DETECT_MIN_AREA,
+                        help="Auto-detection: minimum region area (pixels).")
+    parser.add_argument("--padding", type=int, default=DETECT_PADDING,
+                        help="Auto-detection: margin added around regions (pixels).")
+    parser.add_argument("--workers", type=int, help="Number of plates processed in parallel.")
+
+    args = parser.parse_args()
+
+    # If all args are provided via CLI, return them
+    if args.plates and args.output and (args.manifest or args.detect):
+        return args
+
+    # Otherwise, fallback to GUI dialogs
+    print("Arguments not fully provided. Launching selector...")
+    root = tk.Tk()
+    root.withdraw()
+
+    args.plates = args.plates or list(filedialog.askopenfilenames(
+        title="Select Plate Scans (TIF)",
+        filetypes=[("TIFF Files", "*.tif *.tiff"), ("All Files", "*.*")]
+    ))
+    if not args.plates: return None
+
+    args.output = args.output or filedialog.askdirectory(title="Select Output Folder")
+    if not args.output: return None
+
+    if not args.detect:
+        args.manifest = args.manifest or filedialog.askopenfilename(
+            title="Select Crop Manifest (cancel to auto-detect regions)",
+            filetypes=[("Manifest Files", "*.csv *.json"), ("All Files", "*.*")]
+        )
+        args.detect = not args.manifest
+
+    return args
+
+
+if __name__ == "__main__":
+    args = get_args_or_dialog()
+
+    if not args:
+        print("Selection cancelled.")
+        sys.exit(0)
+
+    plate_paths = _plate_files(args.plates)
+    if not plate_paths:
+        print("No plate scans found.")
+        sys.exit(0)
+
+    if not os.path.exists(args.output):
+        print(f"Creating output directory: {args.output}")
+        os.makedirs(args.output)
+
+    try:
+        crops = None if args.detect else load_manifest(args.manifest)
+        detect = {"stain": args.stain, "merge_gap": args.merge_gap,
+                  "min_area": args.min_area, "padding": args.padding}
+        print(f"Found {len(plate_paths)} plate(s). Processing...")
+        split_plates(plate_paths, args.output, crops, detect, args.workers)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Processing complete. Output saved to: {args.output}")